@@ -15,6 +15,14 @@ class PageAdmin(reversion.VersionAdmin):
         'publish_date',
     ]
 
+    def get_queryset(self, request):
+        qs = super(PageAdmin, self).get_queryset(request)
+        # the changelist only shows rendered parts, which come from the cache.
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.url_name.endswith("_changelist"):
+            qs = qs.defer("content")
+        return qs
+
 
 class FileAdmin(admin.ModelAdmin):
     list_display = [
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restcms.models import Page, PageLink
+
+
+class Command(BaseCommand):
+    help = "Reports internal references to pages which aren't published."
+    option_list = BaseCommand.option_list + (
+        make_option("--language", dest="language", default=None,
+                    help="Only report pages in this language."),
+        make_option("--fail", action="store_true", dest="fail", default=False,
+                    help="Exit with an error when broken links are found."),
+    )
+
+    def handle(self, *args, **options):
+        links = (PageLink.objects
+                 .exclude(target_path__in=Page.published.values("path"))
+                 .select_related("source")
+                 .order_by("source__language", "source__path", "target_path"))
+        if options["language"]:
+            links = links.filter(source__language=options["language"])
+
+        count = 0
+        for link in links:
+            self.stdout.write("%s %s -> %s (%s)" % (
+                link.source.language, link.source.path, link.target_path,
+                link.get_kind_display()))
+            count += 1
+
+        if count and options["fail"]:
+            raise CommandError("%d broken link(s) found." % count)
@@ -0,0 +1,258 @@
+import difflib
+import io
+import multiprocessing
+import os
+import re
+from optparse import make_option
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+import reversion
+
+from restcms import rst
+from restcms.models import Page, PageLink
+
+CHECKPOINT_NAME = ".restcms-import"
+
+
+def render_source(source):
+    """
+    Renders a source in a worker and returns the references it makes.
+
+    The render is offline, so workers never touch the database. Errors
+    are returned rather than raised so a single bad file doesn't stop the
+    pool.
+    """
+    from docutils.utils import SystemMessage
+
+    path, language, content, strict = source
+    context = rst.RenderContext(Page(path=path, language=language), offline=True)
+    overrides = {"report_level": 5, "warning_stream": False}
+    if strict:
+        overrides["halt_level"] = 3
+    try:
+        rst.publish(content, context, **overrides)
+    except SystemMessage as e:
+        return None, force_text(e)
+    return sorted(context.links), None
+
+
+class Source(object):
+
+    def __init__(self, name, path, language):
+        self.name = name
+        self.path = path
+        self.language = language
+        self.content = None
+
+    @property
+    def key(self):
+        return (self.path, self.language)
+
+
+class Command(BaseCommand):
+    args = "<directory>"
+    help = "Imports a tree of <language>/<path>.rst files as pages."
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size", default=500,
+                    help="Number of pages written per transaction and revision."),
+        make_option("--processes", type="int", dest="processes", default=None,
+                    help="Number of render processes, 1 renders in this process. "
+                         "Defaults to the number of CPUs."),
+        make_option("--publish", action="store_true", dest="publish", default=False,
+                    help="Publish the created pages."),
+        make_option("--dry-run", action="store_true", dest="dry_run", default=False,
+                    help="Validate and count the changes without writing them."),
+        make_option("--diff", action="store_true", dest="diff", default=False,
+                    help="Show the changes as a diff without writing them."),
+        make_option("--resume", action="store_true", dest="resume", default=False,
+                    help="Skip the files imported by a previous interrupted run."),
+        make_option("--strict", action="store_true", dest="strict", default=False,
+                    help="Reject files with docutils errors, which saving a page "
+                         "from the editor accepts."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: restcms_import %s" % self.args)
+        self.root = args[0]
+        if not os.path.isdir(self.root):
+            raise CommandError("%s is not a directory." % self.root)
+
+        self.batch_size = options["batch_size"]
+        self.publish = options["publish"]
+        self.diff = options["diff"]
+        self.dry_run = options["dry_run"] or self.diff
+        self.strict = options["strict"]
+        self.checkpoint = os.path.join(self.root, CHECKPOINT_NAME)
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "invalid": 0}
+
+        done = set()
+        if options["resume"] and os.path.exists(self.checkpoint):
+            with io.open(self.checkpoint, encoding="utf-8") as f:
+                done = set(line.rstrip("\n") for line in f)
+        elif not self.dry_run and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        sources = [source for source in self.validate(self.find_sources())
+                   if source.name not in done]
+
+        pool = None
+        if options["processes"] != 1:
+            pool = multiprocessing.Pool(options["processes"])
+        try:
+            for start in range(0, len(sources), self.batch_size):
+                self.import_batch(sources[start:start + self.batch_size], pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.stdout.write("%(created)d created, %(updated)d updated, "
+                          "%(unchanged)d unchanged, %(invalid)d invalid." % self.counts)
+
+    def find_sources(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".rst"):
+                    yield os.path.relpath(os.path.join(dirpath, filename), self.root)
+
+    def validate(self, names):
+        """
+        Maps the file names to pages, reporting the ones which can't be.
+        """
+        languages = dict(settings.LANGUAGES)
+        path_re = re.compile("^%s$" % Page.PATH_RE)
+        sources = []
+        for name in names:
+            parts = name[:-len(".rst")].split(os.sep)
+            language, path = parts[0], "/".join(parts[1:]) + "/"
+            if language not in languages:
+                self.report_invalid(name, "unknown language %s" % language)
+            elif len(parts) < 2 or not path_re.match(path):
+                self.report_invalid(name, "invalid path %s" % path)
+            else:
+                sources.append(Source(name, path, language))
+        return sources
+
+    def report_invalid(self, name, reason):
+        self.counts["invalid"] += 1
+        self.stderr.write("%s: %s" % (name, reason))
+
+    def lookup(self, sources):
+        """
+        Returns a query for the pages of the sources by path and language.
+        """
+        paths = {}
+        for source in sources:
+            paths.setdefault(source.language, []).append(source.path)
+        query = Q(pk__in=[])
+        for language, language_paths in paths.items():
+            query |= Q(language=language, path__in=language_paths)
+        return Page.objects.filter(query)
+
+    def import_batch(self, sources, pool):
+        try:
+            self.write_sources(self.read_sources(sources), pool)
+        finally:
+            # only the current batch is kept in memory.
+            for source in sources:
+                source.content = None
+
+    def read_sources(self, sources):
+        readable = []
+        for source in sources:
+            try:
+                with io.open(os.path.join(self.root, source.name), encoding="utf-8") as f:
+                    source.content = f.read()
+            except UnicodeDecodeError as e:
+                self.report_invalid(source.name, force_text(e))
+            else:
+                readable.append(source)
+        return readable
+
+    def write_sources(self, sources, pool):
+        jobs = [(source.path, source.language, source.content, self.strict)
+                for source in sources]
+        if pool is None:
+            results = [render_source(job) for job in jobs]
+        else:
+            results = pool.map(render_source, jobs)
+
+        existing = dict(((path, language), (pk, content)) for pk, path, language, content
+                        in self.lookup(sources).values_list("pk", "path", "language", "content"))
+
+        creates, updates, links = [], [], {}
+        for source, (source_links, error) in zip(sources, results):
+            if error is not None:
+                self.report_invalid(source.name, error)
+                continue
+            links[source.key] = source_links
+            if source.key not in existing:
+                creates.append(source)
+                self.show_diff(source, "")
+            elif existing[source.key][1] != source.content:
+                updates.append((existing[source.key][0], source))
+                self.show_diff(source, existing[source.key][1])
+            else:
+                self.counts["unchanged"] += 1
+
+        self.counts["created"] += len(creates)
+        self.counts["updated"] += len(updates)
+        if self.dry_run:
+            return
+
+        if creates or updates:
+            self.write_batch(creates, updates, links)
+        # files which failed to render are retried when resuming.
+        with io.open(self.checkpoint, "a", encoding="utf-8") as f:
+            for source in sources:
+                if source.key in links:
+                    f.write(u"%s\n" % source.name)
+
+    def write_batch(self, creates, updates, links):
+        now = timezone.now()
+        status = Page.PUBLIC if self.publish else Page.DRAFT
+        with transaction.atomic():
+            Page.objects.bulk_create([
+                Page(path=source.path, language=source.language, content=source.content,
+                     status=status, publish_date=now if self.publish else None)
+                for source in creates
+            ])
+            # Django doesn't batch updates of different values, but a single
+            # transaction saves the per-row commit.
+            for pk, source in updates:
+                Page.objects.filter(pk=pk).update(content=source.content, updated=now)
+
+            pages = list(self.lookup(creates + [source for pk, source in updates]))
+            PageLink.objects.filter(source__in=pages).delete()
+            PageLink.objects.bulk_create([
+                PageLink(source=page, target_path=path, kind=kind)
+                for page in pages
+                for path, kind in links[(page.path, page.language)]
+            ])
+            reversion.default_revision_manager.save_revision(
+                pages, comment="Imported %d page(s) from %s." % (len(pages), self.root))
+
+        cache.delete_many([page.cache_key for page in pages])
+        # workers can't resolve includes, so the references made by the
+        # included pages are indexed by rendering here.
+        for page in pages:
+            if any(kind == PageLink.INCLUDE for path, kind in links[(page.path, page.language)]):
+                page.refresh_render()
+        Page.refresh_dependents(set(page.path for page in pages),
+                                exclude=[page.pk for page in pages])
+
+    def show_diff(self, source, previous):
+        if not self.diff:
+            return
+        lines = difflib.unified_diff(previous.splitlines(True), source.content.splitlines(True),
+                                     "a/%s" % source.name, "b/%s" % source.name)
+        self.stdout.write("".join(lines), ending="")
@@ -2,8 +2,30 @@ from django.db import models
 from django.utils import timezone
 
 
-class PublishedPageManager(models.Manager):
+class PageManager(models.Manager):
+
+    def get_for_path(self, path, language):
+        """
+        Returns the page on the path preferring the language, or None.
+
+        All the languages are fetched at once so the fallback doesn't cost
+        another round trip.
+        """
+        pages = list(self.filter(path=path))
+        for page in pages:
+            if page.language == language:
+                return page
+        if pages:
+            return pages[0]
+
+
+class PublishedPageManager(PageManager):
+    """
+    Published pages are read for their rendered parts, which usually come
+    from the cache, so the raw content is only loaded when it's accessed.
+    """
 
     def get_query_set(self):
         qs = super(PublishedPageManager, self).get_query_set()
-        return qs.filter(publish_date__lte=timezone.now(), status=self.model.PUBLIC)
+        qs = qs.filter(publish_date__lte=timezone.now(), status=self.model.PUBLIC)
+        return qs.defer("content")
@@ -2,16 +2,22 @@ import os
 import re
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
-from django.utils.encoding import force_bytes
 
 import reversion
 
-from .managers import PublishedPageManager
+from . import rst
+from .managers import PageManager, PublishedPageManager
+
+
+RENDER_CACHE_TIMEOUT = getattr(settings, "RESTCMS_RENDER_CACHE_TIMEOUT", 60 * 60 * 24)
 
 
 class Page(models.Model):
@@ -81,7 +87,7 @@ class Page(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
-    objects = models.Manager()
+    objects = PageManager()
     published = PublishedPageManager()
 
     class Meta:
@@ -90,60 +96,158 @@ class Page(models.Model):
     def __init__(self, *args, **kwargs):
         super(Page, self).__init__(*args, **kwargs)
         self._out = None
+        self._links = None
 
     @property
     def title(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('title')
+            self._render_content(use_cache=True)
+        return self._out.title
 
     @property
     def subtitle(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('subtitle')
+            self._render_content(use_cache=True)
+        return self._out.subtitle
 
     @property
     def body(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('body')
+            self._render_content(use_cache=True)
+        return self._out.body
 
     @property
     def html_title(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('html_title')
+            self._render_content(use_cache=True)
+        return self._out.html_title
 
     @property
     def html_subtitle(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('html_subtitle')
+            self._render_content(use_cache=True)
+        return self._out.html_subtitle
 
     @property
     def html_body(self):
         if self._out is None:
-            self._render_content()
-        return self._out.get('html_body')
+            self._render_content(use_cache=True)
+        return self._out.html_body
 
-    def _render_content(self):
+    @property
+    def cache_key(self):
+        return "restcms:page:%s" % self.pk
+
+    def _render_content(self, use_cache=False, stack=()):
+        if use_cache and self.pk is not None:
+            out = cache.get(self.cache_key)
+            if out is not None:
+                self._out = out
+                return
         try:
-            from docutils.core import publish_parts
+            import docutils  # noqa: only checks it's installed
         except ImportError:
             if settings.DEBUG:
                 raise IOError("The Python docutils library isn't installed.")
-            self._out = {}
+            self._out = rst.RenderedParts()
         else:
-            docutils_settings = getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {})
-            self._out = publish_parts(source=force_bytes(self.content),
-                                      writer_name="html4css1",
-                                      settings_overrides=docutils_settings)
+            context = rst.RenderContext(self, stack)
+            self._out = rst.publish(self.content, context)
+            self._links = context.links
+            if use_cache and not stack and self.pk is not None:
+                cache.set(self.cache_key, self._out, self._cache_timeout())
+
+    def _cache_timeout(self):
+        """
+        Returns how long the render can be cached.
+
+        A referred page scheduled to be published changes the render without
+        being saved, so the render expires when the earliest one is published.
+        """
+        if not self._links:
+            return RENDER_CACHE_TIMEOUT
+        now = timezone.now()
+        scheduled = (Page.objects
+                     .filter(path__in=set(path for path, kind in self._links),
+                             status=Page.PUBLIC, publish_date__gt=now)
+                     .aggregate(models.Min("publish_date"))["publish_date__min"])
+        if scheduled is None:
+            return RENDER_CACHE_TIMEOUT
+        timeout = int((scheduled - now).total_seconds()) + 1
+        if RENDER_CACHE_TIMEOUT is None:
+            return timeout
+        return min(timeout, RENDER_CACHE_TIMEOUT)
+
+    def _store_render(self):
+        """
+        Cache the current render and index the references it found.
+        """
+        cache.set(self.cache_key, self._out, self._cache_timeout())
+        if self._links is not None:
+            self.links.all().delete()
+            PageLink.objects.bulk_create([
+                PageLink(source=self, target_path=path, kind=kind)
+                for path, kind in self._links
+            ])
+
+    def refresh_render(self, visited=None):
+        previous = cache.get(self.cache_key)
+        self._render_content()
+        self._store_render()
+        # a title coming from an included page changes links to this page.
+        if previous is None or previous.title != self._out.title:
+            Page.refresh_dependents([self.path], exclude=[self.pk], visited=visited)
+
+    def _invalidate_dependents(self, previous=None):
+        """
+        Re-render the pages referring to this one.
+
+        Links depend on the path, the publish state and the title of the
+        target, includes depend on its content as well.
+        """
+        paths = set([self.path])
+        links_changed = True
+        includes_changed = True
+        if previous is not None:
+            paths.add(previous.path)
+            links_changed = (previous.path != self.path or
+                             previous.is_published != self.is_published or
+                             previous.title != self.title)
+            includes_changed = links_changed or previous.content != self.content
+
+        if not includes_changed:
+            return
+        exclude = [self.pk] if self.pk is not None else []
+        Page.refresh_dependents(paths, include_only=not links_changed, exclude=exclude)
+
+    @classmethod
+    def refresh_dependents(cls, paths, include_only=False, exclude=(), visited=None):
+        """
+        Re-renders the pages referring to the paths, following the pages
+        whose title changes. ``visited`` holds the pages already refreshed.
+        """
+        if visited is None:
+            visited = set()
+        visited.update(exclude)
+        references = PageLink.objects.filter(target_path__in=paths)
+        if include_only:
+            references = references.filter(kind=PageLink.INCLUDE)
+        dependents = cls.objects.filter(pk__in=references.values("source")).exclude(pk__in=visited)
+        for page in dependents:
+            if page.pk in visited:
+                continue
+            visited.add(page.pk)
+            page.refresh_render(visited)
 
     @models.permalink
     def get_absolute_url(self):
         return ("cms_page", [self.path])
 
+    @property
+    def is_published(self):
+        return (self.status == Page.PUBLIC and self.publish_date is not None and
+                self.publish_date <= timezone.now())
+
     @property
     def is_community(self):
         return self.path.lower().startswith("community/")
@@ -186,12 +290,51 @@ class Page(models.Model):
 
     def save(self, **kwargs):
         self.full_clean()
-        return super(Page, self).save(**kwargs)
+        previous = None
+        if self.pk is not None:
+            previous = Page.objects.filter(pk=self.pk).first()
+            if previous is not None:
+                # render from the cache before it's replaced below.
+                previous._render_content(use_cache=True)
+        result = super(Page, self).save(**kwargs)
+        self._store_render()
+        self._invalidate_dependents(previous)
+        return result
 
 
 reversion.register(Page)
 
 
+@receiver(post_delete)
+def invalidate_deleted_page(sender, instance, **kwargs):
+    # also runs for queryset deletes, which don't call Page.delete(). Not
+    # bound to sender=Page since deferred rows are instances of a subclass.
+    if not isinstance(instance, Page):
+        return
+    cache.delete(instance.cache_key)
+    instance._invalidate_dependents()
+
+
+class PageLink(models.Model):
+    """
+    An internal reference found while rendering the source page.
+    """
+
+    LINK = rst.LINK
+    INCLUDE = rst.INCLUDE
+    KIND_CHOICES = (
+        (LINK, _("Link")),
+        (INCLUDE, _("Include")),
+    )
+
+    source = models.ForeignKey(Page, related_name="links")
+    target_path = models.CharField(max_length=100, db_index=True)
+    kind = models.IntegerField(choices=KIND_CHOICES, default=LINK)
+
+    class Meta:
+        unique_together = (("source", "target_path", "kind"),)
+
+
 def generate_filename(instance, filename):
     return filename
 
@@ -0,0 +1,162 @@
+"""
+reStructuredText extensions for internal references between pages.
+
+``:page:`path/``` or ``:page:`Text <path/>``` links to another page and
+``.. page-include:: path/`` inlines the content of another page. Every
+reference found while rendering is collected on the render context so that
+the referring page can be indexed in ``PageLink``.
+
+docutils is imported lazily so that importing restcms doesn't pay for it.
+"""
+import re
+from xml.sax.saxutils import unescape
+
+from django.conf import settings
+from django.utils.encoding import force_bytes, force_text
+
+LINK = 1
+INCLUDE = 2
+
+explicit_title_re = re.compile(r'^(.+?)\s*(?<!\x00)<(.*?)>$', re.DOTALL)
+
+_registered = False
+
+
+class RenderedParts(object):
+    """
+    The parts of ``publish_parts()`` which restcms uses.
+
+    The other parts (``whole``, ``stylesheet``, ``fragment`` and so on) are
+    dropped, since renders are kept around in the cache.
+    """
+
+    __slots__ = ("title", "subtitle", "body", "html_title", "html_subtitle", "html_body")
+
+    def __init__(self, parts=None):
+        parts = parts or {}
+        for name in self.__slots__:
+            setattr(self, name, parts.get(name))
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+
+def normalize_path(path):
+    path = path.strip().lstrip("/")
+    if path and not path.endswith("/"):
+        path += "/"
+    return path
+
+
+class RenderContext(object):
+    """
+    State shared by the roles and directives during a single render.
+    """
+
+    def __init__(self, page, stack=(), offline=False):
+        self.page = page
+        self.stack = tuple(stack) + (page.path,)
+        self.offline = offline
+        self.links = set()
+        self.included = set()
+
+    def resolve(self, path, kind):
+        """
+        Records the reference and returns the published page it points to.
+
+        Offline contexts only record, so they can be used without a database
+        connection.
+        """
+        from .models import Page
+
+        self.links.add((path, kind))
+        if self.offline or not re.match("^%s$" % Page.PATH_RE, path):
+            return None
+        return Page.published.get_for_path(path, self.page.language)
+
+    def title_of(self, target):
+        if target.path in self.stack:
+            return target.path
+        if target._out is None:
+            target._render_content(use_cache=True, stack=self.stack)
+        title = target._out.title
+        if not title:
+            return target.path
+        # the title part is already HTML encoded.
+        return unescape(force_text(title), {"&quot;": '"', "&#64;": "@"})
+
+
+def page_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
+    from docutils import nodes, utils
+
+    context = inliner.document.settings.restcms_context
+    text = utils.unescape(text)
+    match = explicit_title_re.match(text)
+    if match:
+        title, path = match.group(1), normalize_path(match.group(2))
+    else:
+        title, path = None, normalize_path(text)
+
+    target = context.resolve(path, LINK)
+    if target is None:
+        return [nodes.inline(rawtext, title or path, classes=["broken-link"])], []
+    if title is None:
+        title = context.title_of(target)
+    return [nodes.reference(rawtext, title, refuri=target.get_absolute_url(),
+                            classes=["page-link"])], []
+
+
+def make_page_include():
+    from docutils import statemachine
+    from docutils.parsers.rst import Directive
+
+    class PageInclude(Directive):
+        required_arguments = 1
+        has_content = False
+
+        def run(self):
+            document = self.state.document
+            context = document.settings.restcms_context
+            path = normalize_path(self.arguments[0])
+
+            target = context.resolve(path, INCLUDE)
+            if target is None or path in context.stack or path in context.included:
+                error = document.reporter.warning(
+                    'Cannot include page "%s".' % path, line=self.lineno)
+                return [error]
+
+            context.included.add(path)
+            lines = statemachine.string2lines(force_text(target.content),
+                                              document.settings.tab_width,
+                                              convert_whitespace=True)
+            self.state_machine.insert_input(lines, "page:%s" % path)
+            return []
+
+    return PageInclude
+
+
+def publish(content, context, **overrides):
+    from docutils.core import publish_parts
+
+    register()
+    docutils_settings = dict(getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {}))
+    docutils_settings.update(overrides)
+    docutils_settings["restcms_context"] = context
+    parts = publish_parts(source=force_bytes(content),
+                          writer_name="html4css1",
+                          settings_overrides=docutils_settings)
+    return RenderedParts(parts)
+
+
+def register():
+    global _registered
+    if _registered:
+        return
+    from docutils.parsers.rst import directives, roles
+
+    roles.register_local_role("page", page_role)
+    directives.register_directive("page-include", make_page_include())
+    _registered = True
@@ -1,3 +1,6 @@
+import io
+import os
+import shutil
 import tempfile
 
 from six import StringIO
@@ -6,8 +9,9 @@ from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils.encoding import force_text
 
-from .models import Page, File
+from .models import Page, PageLink, File, RENDER_CACHE_TIMEOUT
 
 
 class PageEditorRoleMixin(object):
@@ -114,6 +118,43 @@ class PageViewTest(TestCase, PageMixin, PageEditorRoleMixin):
         response = self.client.get(url)
         self.assertPageUsed(response, page_default)
 
+    def test_get_page_fallback_in_one_query(self):
+        from .views import get_page
+
+        page = self.create_page(path="foo/", language="ja", status=Page.PUBLIC)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_page("foo/", settings.LANGUAGES[0][0]), page)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_page("bar/", "ja"), None)
+
+    def test_published_defers_content(self):
+        self.create_page(path="foo/", content="Hello\n=====\n\nWorld.", status=Page.PUBLIC)
+        page = Page.published.get(path="foo/")
+
+        # the render is cached on save, so the content isn't loaded.
+        with self.assertNumQueries(0):
+            self.assertEqual(page.title, "Hello")
+            self.assertIn("<p>World.</p>", page.body)
+        self.assertFalse(hasattr(page._out, "whole"))
+
+        with self.assertNumQueries(1):
+            self.assertIn("World.", page.content)
+
+    def test_admin_changelist_defers_content(self):
+        from django.contrib import admin
+        from django.core.urlresolvers import ResolverMatch
+        from django.test import RequestFactory
+
+        self.create_page(path="foo/", status=Page.PUBLIC)
+        page_admin = admin.site._registry[Page]
+        request = RequestFactory().get("/")
+
+        request.resolver_match = ResolverMatch(None, (), {}, url_name="restcms_page_changelist")
+        self.assertNotIn("content", page_admin.get_queryset(request).get(path="foo/").__dict__)
+
+        request.resolver_match = ResolverMatch(None, (), {}, url_name="restcms_page_change")
+        self.assertIn("content", page_admin.get_queryset(request).get(path="foo/").__dict__)
+
     def test_editable(self):
         path = "foo/"
         url = reverse("cms_page", kwargs={"path": path})
@@ -297,4 +338,250 @@ class FileDownloadTest(TestCase, FileMixin):
         url = f.download_url()
         with self.settings(USE_X_ACCEL_REDIRECT=True):
             response = self.client.get(url)
-        self.assertEqual(response["X-Accel-Redirect"], f.file.url)
\ No newline at end of file
+        self.assertEqual(response["X-Accel-Redirect"], f.file.url)
+
+
+class PageLinkTest(TestCase, PageMixin):
+    def test_link(self):
+        target = self.create_page(path="target/", content="Target\n======",
+                                  status=Page.PUBLIC)
+        page = self.create_page(path="source/", content="See :page:`target/`.",
+                                status=Page.PUBLIC)
+        self.assertIn('href="%s"' % target.get_absolute_url(), page.body)
+        self.assertIn('>Target</a>', page.body)
+        self.assertEqual(list(page.links.values_list("target_path", "kind")),
+                         [("target/", PageLink.LINK)])
+
+    def test_broken_link(self):
+        page = self.create_page(path="source/", content="See :page:`Missing <missing/>`.")
+        self.assertIn('class="broken-link">Missing</span>', page.body)
+        self.assertEqual(page.links.get().target_path, "missing/")
+
+    def test_include(self):
+        self.create_page(path="snippet/", content="Included text.", status=Page.PUBLIC)
+        page = self.create_page(path="source/", content=".. page-include:: snippet/")
+        self.assertIn("Included text.", page.body)
+        self.assertEqual(page.links.get().kind, PageLink.INCLUDE)
+
+    def test_invalidate_dependents(self):
+        target = self.create_page(path="target/", content="Target\n======",
+                                  status=Page.PUBLIC)
+        snippet = self.create_page(path="snippet/", content="Old text.", status=Page.PUBLIC)
+        page = self.create_page(path="source/",
+                                content="See :page:`target/`.\n\n.. page-include:: snippet/")
+
+        # a title change re-renders the linking page.
+        target.content = "Renamed\n======="
+        target.save()
+        self.assertIn('>Renamed</a>', Page.objects.get(pk=page.pk).body)
+
+        # a content change re-renders the including page.
+        snippet.content = "New text."
+        snippet.save()
+        self.assertIn("New text.", Page.objects.get(pk=page.pk).body)
+
+        # unpublishing breaks the link.
+        target.reject()
+        target.save()
+        self.assertIn('class="broken-link"', Page.objects.get(pk=page.pk).body)
+
+    def test_invalidate_through_included_title(self):
+        self.create_page(path="c/", content="Old\n===", status=Page.PUBLIC)
+        self.create_page(path="b/", content=".. page-include:: c/", status=Page.PUBLIC)
+        page = self.create_page(path="a/", content=":page:`b/`")
+        self.assertIn('>Old</a>', page.body)
+
+        c = Page.objects.get(path="c/")
+        c.content = "New\n==="
+        c.save()
+        self.assertIn('>New</a>', Page.objects.get(pk=page.pk).body)
+
+    def test_delete(self):
+        target = self.create_page(path="target/", status=Page.PUBLIC)
+        other = self.create_page(path="other/", status=Page.PUBLIC)
+        page = self.create_page(path="source/", content=":page:`target/` :page:`other/`")
+        self.assertNotIn('class="broken-link"', Page.objects.get(pk=page.pk).body)
+
+        target.delete()
+        self.assertIn('class="broken-link">target/</span>', Page.objects.get(pk=page.pk).body)
+
+        # queryset deletes don't call Page.delete().
+        Page.objects.filter(pk=other.pk).delete()
+        self.assertIn('class="broken-link">other/</span>', Page.objects.get(pk=page.pk).body)
+
+    def test_delete_deferred(self):
+        self.create_page(path="target/", status=Page.PUBLIC)
+        page = self.create_page(path="source/", content=":page:`target/`")
+
+        # Page.published defers the content, loading a Page subclass.
+        Page.published.get(path="target/").delete()
+        self.assertIn('class="broken-link">target/</span>', Page.objects.get(pk=page.pk).body)
+
+    def test_admin_bulk_delete(self):
+        from django.contrib import admin
+        from django.contrib.admin.actions import delete_selected
+        from django.contrib.auth.models import User
+        from django.contrib.messages.storage.cookie import CookieStorage
+        from django.core.urlresolvers import ResolverMatch
+        from django.test import RequestFactory
+
+        target = self.create_page(path="target/", status=Page.PUBLIC)
+        page = self.create_page(path="source/", content=":page:`target/`")
+
+        request = RequestFactory().post("/", {"post": "yes"})
+        request.user = User.objects.create_superuser("admin", "admin@bar.com", "passwd")
+        request._messages = CookieStorage(request)
+        request.resolver_match = ResolverMatch(None, (), {}, url_name="restcms_page_changelist")
+        page_admin = admin.site._registry[Page]
+        delete_selected(page_admin, request, page_admin.get_queryset(request).filter(pk=target.pk))
+
+        self.assertFalse(Page.objects.filter(pk=target.pk).exists())
+        self.assertIn('class="broken-link">target/</span>', Page.objects.get(pk=page.pk).body)
+
+    def test_scheduled_target_limits_cache_timeout(self):
+        import datetime
+
+        from django.utils import timezone
+
+        target = Page(path="target/", content="content", language=settings.LANGUAGES[0][0],
+                      status=Page.PUBLIC,
+                      publish_date=timezone.now() + datetime.timedelta(hours=1))
+        target.save()
+        page = self.create_page(path="source/", content=":page:`target/`")
+        self.assertIn('class="broken-link"', page.body)
+        self.assertLessEqual(page._cache_timeout(), 60 * 60 + 1)
+
+        unrelated = self.create_page(path="unrelated/", content=":page:`source/`")
+        self.assertEqual(unrelated._cache_timeout(), RENDER_CACHE_TIMEOUT)
+
+    def test_brokenlinks_command(self):
+        from django.core.management import call_command
+
+        self.create_page(path="target/", status=Page.PUBLIC)
+        self.create_page(path="source/", content=":page:`target/` :page:`missing/`")
+        out = StringIO()
+        call_command("restcms_brokenlinks", stdout=out)
+        self.assertEqual(out.getvalue().strip().splitlines(),
+                         ["%s source/ -> missing/ (Link)" % settings.LANGUAGES[0][0]])
+
+    def test_brokenlinks_command_options(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        language, other_language = settings.LANGUAGES[0][0], settings.LANGUAGES[1][0]
+        self.create_page(path="source/", content=":page:`missing/`", language=language)
+        self.create_page(path="source/", content=":page:`absent/`", language=other_language)
+
+        out = StringIO()
+        call_command("restcms_brokenlinks", language=other_language, stdout=out)
+        self.assertEqual(out.getvalue().strip().splitlines(),
+                         ["%s source/ -> absent/ (Link)" % other_language])
+
+        with self.assertRaises(CommandError):
+            call_command("restcms_brokenlinks", fail=True, stdout=StringIO())
+
+
+class ImportCommandTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.language = settings.LANGUAGES[0][0]
+        self.write("%s/foo.rst" % self.language, "Foo\n===\n\nSee :page:`bar/baz/`.\n")
+        self.write("%s/bar/baz.rst" % self.language, "Baz\n===\n")
+        self.write("%s/bad path.rst" % self.language, "Bad\n")
+        self.write("unknown/foo.rst", "Unknown\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        filename = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with io.open(filename, "w", encoding="utf-8") as f:
+            f.write(force_text(content))
+
+    def run_import(self, **options):
+        from django.core.management import call_command
+
+        options.setdefault("processes", 1)
+        out = StringIO()
+        call_command("restcms_import", self.root, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_import(self):
+        import reversion
+
+        out = self.run_import(publish=True)
+        self.assertIn("2 created, 0 updated, 0 unchanged, 2 invalid.", out)
+
+        page = Page.published.get(path="foo/", language=self.language)
+        self.assertEqual(page.title, "Foo")
+        self.assertEqual(list(page.links.values_list("target_path", flat=True)), ["bar/baz/"])
+        self.assertEqual(len(reversion.get_for_object(page)), 1)
+
+        self.write("%s/bar/baz.rst" % self.language, "Renamed\n=======\n")
+        out = self.run_import()
+        self.assertIn("0 created, 1 updated, 1 unchanged, 2 invalid.", out)
+        self.assertEqual(Page.objects.get(path="bar/baz/").title, "Renamed")
+
+    def test_dry_run_and_diff(self):
+        out = self.run_import(dry_run=True)
+        self.assertIn("2 created", out)
+        self.assertFalse(Page.objects.filter(path__in=["foo/", "bar/baz/"]).exists())
+
+        out = self.run_import(diff=True)
+        self.assertIn("+Baz", out)
+        self.assertFalse(Page.objects.filter(path__in=["foo/", "bar/baz/"]).exists())
+
+    def test_resume(self):
+        self.run_import()
+        Page.objects.filter(path="foo/").update(content="Edited")
+
+        out = self.run_import(resume=True)
+        self.assertIn("0 created, 0 updated, 0 unchanged", out)
+        self.assertEqual(Page.objects.get(path="foo/").content, "Edited")
+
+    def test_process_pool(self):
+        out = self.run_import(processes=2)
+        self.assertIn("2 created, 0 updated, 0 unchanged, 2 invalid.", out)
+        self.assertEqual(list(Page.objects.get(path="foo/").links.values_list("target_path", flat=True)),
+                         ["bar/baz/"])
+
+    def test_include_references(self):
+        self.write("%s/snippet.rst" % self.language, "See :page:`foo/`.\n")
+        self.write("%s/main.rst" % self.language, ".. page-include:: snippet/\n")
+        self.run_import(publish=True)
+
+        page = Page.objects.get(path="main/")
+        self.assertEqual(sorted(page.links.values_list("target_path", "kind")),
+                         [("foo/", PageLink.LINK), ("snippet/", PageLink.INCLUDE)])
+        self.assertIn('href="%s"' % reverse("cms_page", args=["foo/"]), page.body)
+
+    def test_invalid_files(self):
+        self.write("%s/unknown.rst" % self.language, ".. no-such-directive::\n")
+        with io.open(os.path.join(self.root, self.language, "latin1.rst"), "wb") as f:
+            f.write(b"caf\xe9\n")
+
+        # the editor accepts docutils errors, only --strict rejects them.
+        out = self.run_import(dry_run=True)
+        self.assertIn("3 created, 0 updated, 0 unchanged, 3 invalid.", out)
+        out = self.run_import(dry_run=True, strict=True)
+        self.assertIn("2 created, 0 updated, 0 unchanged, 4 invalid.", out)
+
+    def test_publish_only_created(self):
+        self.run_import()
+        self.write("%s/foo.rst" % self.language, "Changed\n")
+        self.write("%s/new.rst" % self.language, "New\n")
+        self.run_import(publish=True)
+
+        self.assertEqual(Page.objects.get(path="foo/").status, Page.DRAFT)
+        self.assertEqual(Page.objects.get(path="new/").status, Page.PUBLIC)
+
+    def test_arguments(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            call_command("restcms_import", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("restcms_import", os.path.join(self.root, "missing"), stdout=StringIO())
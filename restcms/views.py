@@ -16,19 +16,11 @@ def can_edit(page, user):
 
 
 def get_page(path, language, published=True):
-    key = {"path": path, "language": language}
     if published:
         objects = Page.published
     else:
         objects = Page.objects
-    try:
-        return objects.get(**key)
-    except Page.DoesNotExist:
-        # fallback just with path
-        key = {"path": path}
-        q = objects.filter(**key)
-        if q.count() > 0:
-            return q.all()[0]
+    return objects.get_for_path(path, language)
 
 
 def page_view(request, path):
@@ -15,6 +15,7 @@ settings.configure(DEBUG=True,
                                    'django.contrib.contenttypes',
                                    'django.contrib.sessions',
                                    'django.contrib.admin',
+                                   'reversion',
                                    'restcms',),
                    MIDDLEWARE_CLASSES=[
                        'django.contrib.sessions.middleware.SessionMiddleware',